@@ -3,33 +3,46 @@ from PIL import Image as PILImage
 import base64
 import json, io, os
 import boto3
-import sagemaker
+from botocore.config import Config
 session = boto3.Session()
-sagemaker_session = sagemaker.Session()
-studio_region = sagemaker_session.boto_region_name 
-bedrock = session.client("bedrock", region_name=studio_region)
-br = session.client("bedrock-runtime", region_name=studio_region)
+#Region comes from the boto3 session, a sagemaker.Session() here only added round trips at import
+studio_region = session.region_name or os.environ.get("AWS_REGION", "us-east-1")
+client_config = Config(max_pool_connections=32, retries={"max_attempts": 3, "mode": "adaptive"})
+bedrock = session.client("bedrock", region_name=studio_region, config=client_config)
+br = session.client("bedrock-runtime", region_name=studio_region, config=client_config)
 claude_sonnet_model_id = "anthropic.claude-3-sonnet-20240229-v1:0"
 titan_embed_model_id = "amazon.titan-embed-image-v1"
 
+#Modes Image.reduce supports, anything else (P, 1, I;16...) takes the Lanczos path
+reduce_modes = ("L", "LA", "RGB", "RGBA", "CMYK", "I", "F")
 
-def resize_img(b64imgstr, size=(256, 256)):
+
+def _resize_img_file(img_file, size=(256, 256)):
     buffer = io.BytesIO()
-    img = base64.b64decode(b64imgstr)
-    img = PILImage.open(io.BytesIO(img))
+    img = PILImage.open(img_file)
+    img_format = img.format
+    if img_format == "JPEG":
+        img.draft("RGB", size) #Let libjpeg downscale while decoding
+
+    #Integer box reduction for large downscales, Lanczos only when the ratio is under 2
+    factor = min(img.size[0] // size[0], img.size[1] // size[1])
+    if factor >= 2 and img.mode in reduce_modes:
+        rimg = img.reduce(factor).resize(size, PILImage.BILINEAR)
+    else:
+        rimg = img.resize(size, PILImage.LANCZOS)
+    rimg.save(buffer, format=img_format)
 
-    rimg = img.resize(size, PILImage.LANCZOS)
-    rimg.save(buffer, format=img.format)
+    return base64.b64encode(buffer.getbuffer()).decode("ascii")
 
-    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+def resize_img(b64imgstr, size=(256, 256)):
+    return _resize_img_file(io.BytesIO(base64.b64decode(b64imgstr)), size)
 
 def img2base64(image_path,resize=False):
     with open(image_path, "rb") as img_f:
-        img_data = base64.b64encode(img_f.read())
-    if resize:
-        return resize_img(img_data.decode())
-    else:
-        return img_data.decode()
+        if resize:
+            #Decode straight from the file, no base64 round trip
+            return _resize_img_file(img_f)
+        return base64.b64encode(img_f.read()).decode("ascii")
 
 
 def invoke_claude_sonnet_multi(prompts, image_paths):
@@ -50,7 +63,7 @@ def invoke_claude_sonnet_multi(prompts, image_paths):
     response = br.invoke_model(
         body=body, modelId=claude_sonnet_model_id, accept=accept, contentType=contentType
     )
-    response_body = json.loads(response.get("body").read())
+    response_body = json.load(response.get("body"))
     return response_body.get("content")[0]["text"]
 
 
@@ -8,9 +8,26 @@ from chromadb.api.types import (
 )
 import chromadb.utils.embedding_functions
 from chromadb.config import Settings
+from weakref import WeakKeyDictionary
+from concurrent.futures import ThreadPoolExecutor
 import json
 
+#Share one bedrock-runtime client per session/config across embedding functions,
+#weakly keyed on the session so short-lived sessions and their clients can be collected
+_BEDROCK_RUNTIME_CLIENTS = WeakKeyDictionary()
+
+def _bedrock_runtime_client(session: "boto3.Session", **kwargs: Any):
+    session_clients = _BEDROCK_RUNTIME_CLIENTS.setdefault(session, {})
+    client_key = tuple(sorted(kwargs.items()))
+    if client_key not in session_clients:
+        session_clients[client_key] = session.client(service_name="bedrock-runtime", **kwargs)
+    return session_clients[client_key]
+
 class AmazonBedrockTitanMultiModalEmbeddingFunction(EmbeddingFunction[Documents]):
+    accept = "application/json"
+    content_type = "application/json"
+    max_workers = 4
+
     def __init__(
         self,
         session: "boto3.Session",  
@@ -18,32 +35,37 @@ class AmazonBedrockTitanMultiModalEmbeddingFunction(EmbeddingFunction[Documents]
         **kwargs: Any,
     ):
         self._model_name = model_name
-        self._client = session.client(
-            service_name="bedrock-runtime",
-            **kwargs,
-        )
+        self._client = _bedrock_runtime_client(session, **kwargs)
 
-    def embed(self, inputText:str =None,inputImage:str = None) -> Embeddings:
-        accept = "application/json"
-        content_type = "application/json"
+    def _embed_one(self, inputText:str =None,inputImage:str = None) -> List[float]:
         body = {}
         if inputText:
             body["inputText"] = inputText
         if inputImage:
             body["inputImage"] = inputImage
-            body = json.dumps(body)
-            response = self._client.invoke_model(
-                body=body,
-                modelId=self._model_name,
-                accept=accept,
-                contentType=content_type,
-            )
-            embedding = json.load(response.get("body")).get("embedding")
-        return [embedding]
+        response = self._client.invoke_model(
+            body=json.dumps(body),
+            modelId=self._model_name,
+            accept=self.accept,
+            contentType=self.content_type,
+        )
+        return json.load(response.get("body")).get("embedding")
+
+    def embed(self, inputText:str =None,inputImage:str = None) -> Embeddings:
+        return [self._embed_one(inputText,inputImage)]
+
+    def __call__(self, input: Documents) -> Embeddings:
+        #Titan takes one input per request, so overlap the round trips
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self._embed_one, input))
 
 
 
 class AmazonBedrockCohereEmbeddingFunction(EmbeddingFunction[Documents]):
+    accept = "application/json"
+    content_type = "application/json"
+    max_batch_size = 96
+
     def __init__(
         self,
         session: "boto3.Session",  
@@ -53,25 +75,19 @@ class AmazonBedrockCohereEmbeddingFunction(EmbeddingFunction[Documents]):
     ):
         self._model_name = model_name
         self.input_type = input_type
-        self._client = session.client(
-            service_name="bedrock-runtime",
-            **kwargs,
-        )
+        self._client = _bedrock_runtime_client(session, **kwargs)
 
     def __call__(self, input: Documents) -> Embeddings:
-        accept = "application/json"
-        content_type = "application/json"
- 
         embeddings = []
-        for text in input:
-            input_body = {"texts": [text], "input_type": self.input_type, "truncate":"START"}
+        #Cohere embed accepts up to 96 texts per request
+        for i in range(0, len(input), self.max_batch_size):
+            input_body = {"texts": input[i:i + self.max_batch_size], "input_type": self.input_type, "truncate":"START"}
             body = json.dumps(input_body)
             response = self._client.invoke_model(
                 body=body,
                 modelId=self._model_name,
-                accept=accept,
-                contentType=content_type,
+                accept=self.accept,
+                contentType=self.content_type,
             )
-            embedding = json.load(response.get("body")).get("embeddings")
-            embeddings.append(embedding)
+            embeddings.extend(json.load(response.get("body")).get("embeddings"))
         return embeddings
\ No newline at end of file
@@ -6,24 +6,50 @@ from dspy.datasets.dataset import Dataset
 import dspy
 import chromadb
 from datasets import load_dataset
-import random
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import json
 import dsp
-from dspy.signatures.signature import ensure_signature, signature_to_template
+from functools import lru_cache
+from weakref import WeakKeyDictionary
+import threading
+from dspy.signatures.signature import Signature, ensure_signature, signature_to_template
 from dspy import Prediction
 
+#Reuse the loaded DatasetDict when a dataset class is constructed more than once
+@lru_cache(maxsize=None)
+def _load_raw_dataset(name):
+    return load_dataset(name)
+
+#Project a QA split to example dicts using Arrow kernels instead of per-row Python access
+def _to_examples(dataset, keys, require_answer=False, shuffle_seed=None):
+    table = dataset.with_format("arrow")[:]
+    if require_answer:
+        answer_texts = table["answers"].combine_chunks().field("text")
+        table = table.filter(pc.greater(pc.list_value_length(answer_texts), 0))
+    if shuffle_seed is not None:
+        table = table.take(np.random.default_rng(shuffle_seed).permutation(table.num_rows))
+
+    answers = table["answers"].combine_chunks()
+    columns = {
+        "answer": pc.list_element(answers.field("text"), 0),
+        "answer_start": pc.cast(pc.list_element(answers.field("answer_start"), 0), pa.string()),
+    }
+    values = [(columns[k] if k in columns else table[k]).to_pylist() for k in keys]
+    return [dict(zip(keys, row)) for row in zip(*values)]
+
 class SolarEnergyQA(Dataset):
     def __init__(self, *args, keep_details=True,**kwargs) -> None:
         super().__init__(*args, **kwargs)
  
-        raw_datasets = load_dataset("squad")
+        raw_datasets = _load_raw_dataset("squad")
         category = 'Solar_energy'
         
-        full_train_set = raw_datasets['train'].filter(lambda x: x['title'] == category)
-        full_test_set = raw_datasets['validation'].filter(lambda x: x['title'] == category)
-        
-        train_set = []
-        test_set = []
+        #Vectorized Arrow predicate, avoids a Python callback per row
+        title_filter = lambda t: pc.equal(t["title"], category)
+        full_train_set = raw_datasets['train'].with_format("arrow").filter(title_filter, batched=True)
+        full_test_set = raw_datasets['validation'].with_format("arrow").filter(title_filter, batched=True)
         
         if len(full_test_set) == 0: #If there is no test data set available, split the train set for this
             split_set = full_train_set.train_test_split(test_size=0.1)
@@ -34,20 +60,8 @@ class SolarEnergyQA(Dataset):
         else:
             keys = ['context', 'question', 'answer','answer_start']
 
-        for set_item in full_train_set:
-            set_item['answer'] = set_item['answers']['text'][0]
-            set_item['answer_start'] = str(set_item['answers']['answer_start'][0])
-            example = {k: set_item[k] for k in keys}
-            train_set.append(example)
-        
-        for set_item in full_test_set:
-            set_item['answer'] = set_item['answers']['text'][0]
-            set_item['answer_start'] = str(set_item['answers']['answer_start'][0])
-            example = {k: set_item[k] for k in keys}
-            test_set.append(example)
-
-        rng = random.Random(0)
-        rng.shuffle(train_set)
+        train_set = _to_examples(full_train_set, keys, shuffle_seed=0)
+        test_set = _to_examples(full_test_set, keys)
 
         self._train = train_set
         self._test = test_set
@@ -56,41 +70,46 @@ class CUAD(Dataset):
     def __init__(self, *args,**kwargs) -> None:
         super().__init__(*args, **kwargs)
  
-        raw_datasets = load_dataset("cuad")
+        raw_datasets = _load_raw_dataset("cuad")
        
         full_train_set = raw_datasets['train']
         full_test_set = raw_datasets['test']
         
-        train_set = []
-        test_set = []
-        
         if len(full_test_set) == 0: #If there is no test data set available, split the train set for this
             split_set = full_train_set.train_test_split(test_size=0.1)
             full_train_set,full_test_set = split_set['train'],split_set['test']
         
         keys = ['id', 'title', 'context', 'question', 'answer','answer_start']
 
-        for set_item in full_train_set:
-            if len(set_item['answers']['text']) > 0:
-                set_item['answer'] = set_item['answers']['text'][0]
-                set_item['answer_start'] = str(set_item['answers']['answer_start'][0])
-                example = {k: set_item[k] for k in keys}
-                train_set.append(example)
-        
-        for set_item in full_test_set:
-             if len(set_item['answers']['text']) > 0:
-                set_item['answer'] = set_item['answers']['text'][0]
-                set_item['answer_start'] = str(set_item['answers']['answer_start'][0])
-                example = {k: set_item[k] for k in keys}
-                test_set.append(example)
-
-        rng = random.Random(0)
-        rng.shuffle(train_set)
+        #Only keep the questions that have an answer
+        train_set = _to_examples(full_train_set, keys, require_answer=True, shuffle_seed=0)
+        test_set = _to_examples(full_test_set, keys, require_answer=True)
 
         self._train = train_set
         self._test = test_set
 
 
+#Image fields and the prompt template only depend on the signature, so they are worked out once per signature
+_SIGNATURE_CACHE = WeakKeyDictionary()
+_SIGNATURE_CACHE_LOCK = threading.Lock()
+
+def _image_fields_and_template(signature):
+    cached = _SIGNATURE_CACHE.get(signature)
+    if cached is None:
+        image_fields = tuple((k, v.json_schema_extra["format"]) for k,v in signature.input_fields.items()
+                             if v.json_schema_extra.get("format") in ("jpg", "png"))
+        #Build an image-less copy, the shared signature class is left untouched.
+        #Without image fields no copy is needed, and None keeps the entry from referencing its own key
+        text_signature = None
+        if image_fields:
+            image_keys = {k for k, _ in image_fields}
+            text_signature = Signature({k: (v.annotation, v) for k, v in signature.fields.items() if k not in image_keys},
+                                       signature.instructions)
+        cached = (image_fields, text_signature, signature_to_template(signature if text_signature is None else text_signature))
+        with _SIGNATURE_CACHE_LOCK:
+            cached = _SIGNATURE_CACHE.setdefault(signature, cached)
+    return cached
+
 #This is based on https://github.com/stanfordnlp/dspy/blob/1c10a9d476737533a53d6bee62c234e375eb8fcb/dspy/predict/predict.py
 class PredictMultiModal(dspy.Predict):
     def __init__(self, signature, activated=True, **config):
@@ -112,7 +131,6 @@ class PredictMultiModal(dspy.Predict):
         demos = kwargs.pop("demos", self.demos)
         config = dict(**self.config, **kwargs.pop("config", {}))
         image_prompt = {}
-        image_fields = []
         lm = kwargs.pop("lm", self.lm) or dsp.settings.lm
         assert lm is not None, "No LM is loaded."
 
@@ -132,32 +150,26 @@ class PredictMultiModal(dspy.Predict):
         if new_signature is not None:
             signature = new_signature
 
-        if not all(k in kwargs for k in signature.input_fields):
+        missing = signature.input_fields.keys() - kwargs.keys()
+        if missing:
             present = [k for k in signature.input_fields if k in kwargs]
-            missing = [k for k in signature.input_fields if k not in kwargs]
+            missing = [k for k in signature.input_fields if k in missing]
             print(f"WARNING: Not all input fields were provided to module. Present: {present}. Missing: {missing}.")
 
 
         # Look up the appropriate fields in each demonstration.
         x = x.demos_at(lambda d: d[self.stage])
 
-        #Remove the image prompt fields from signature
-        for k,v in signature.input_fields.items():
-            if "format" in v.json_schema_extra and (v.json_schema_extra["format"] == "jpg" or v.json_schema_extra["format"] == "png"):
-                image_fields.append(k)
-                #image_prompt[k] = {v.json_schema_extra["format"]:v}
-                image_prompt[k] = {v.json_schema_extra["format"]:x.pop(k)}
-                signature.model_fields.pop(k)
-
-        template = signature_to_template(signature)
+        image_fields, text_signature, template = _image_fields_and_template(signature)
+        if text_signature is not None:
+            signature = text_signature
+        for k, img_format in image_fields:
+            image_prompt[k] = {img_format:x.pop(k)}
 
         # Generate and extract the fields.
         prompt = template(x)
-        if self.lm is None:
-            C: list[dict[str, Any]] = dsp.settings.lm(prompt,image_prompt, **kwargs)
-        else:
-            with dsp.settings.context(lm=self.lm, query_only=True):
-                C: list[dict[str, Any]] = dsp.settings.lm(prompt,image_prompt, **kwargs)
+        #Call the resolved LM directly rather than pushing it into dsp.settings for one call
+        C: list[dict[str, Any]] = lm(prompt,image_prompt, **kwargs)
 
         completions = []
         for c in C:
@@ -209,10 +221,9 @@ class AWSAnthropicMultiModal(AWSModel):
     def _create_body(self, prompt: str, images:str, **kwargs) -> tuple[int, dict[str, str | float]]:
         base_args: dict[str, Any] = self.kwargs
 
-        image_prompts = []
-        for k,v in images.items():
-            img_ext, imgbase64_str = list(v.items())[0]
-            image_prompts.append({"type": "image", "source": {"type": "base64","media_type": f"image/{img_ext}","data": imgbase64_str}})
+        #Each image field maps a single {format: base64 data} pair
+        image_prompts = [{"type": "image", "source": {"type": "base64","media_type": f"image/{img_ext}","data": imgbase64_str}}
+                         for img_ext, imgbase64_str in (next(iter(v.items())) for v in images.values())]
 
         n, query_args = self.aws_provider.sanitize_kwargs(base_args)
 
@@ -230,7 +241,7 @@ class AWSAnthropicMultiModal(AWSModel):
             model_id=self._model_name,
             body=body
         )
-        response_body = json.loads(response["body"].read())
+        response_body = json.load(response["body"])
         completion = response_body["content"][0]["text"]
         return completion
 
@@ -254,10 +265,6 @@ class ChromadbRMMultiModal(dspy.Retrieve):
         embeddings = self._get_embeddings(query,imagebase64)
         k = self.k if k is None else k
         results = self._chromadb_collection.query(query_embeddings=embeddings, n_results=k,**kwargs,)
-        zipped_results = zip(
-            results["ids"][0], 
-            results["distances"][0], 
-            results["documents"][0], 
-            results["metadatas"][0])
-        results = [dotdict({"id": id, "score": dist, "long_text": doc, "metadatas": meta }) for id, dist, doc, meta in zipped_results]
-        return results
\ No newline at end of file
+        #Single query, so only the first row of each result column is used
+        ids, distances, documents, metadatas = (results[col][0] for col in ("ids", "distances", "documents", "metadatas"))
+        return [dotdict(id=id, score=dist, long_text=doc, metadatas=meta) for id, dist, doc, meta in zip(ids, distances, documents, metadatas)]
\ No newline at end of file